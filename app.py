@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
-from openai import OpenAI
+import numpy as np
+from openai import OpenAI, OpenAIError
 from datetime import datetime
+import hashlib
+import json
+import os
+import tempfile
+from diskcache import Cache
 
 # ================= PAGE CONFIG =================
 st.set_page_config(page_title="Productivity AI Toolkit", layout="wide")
@@ -10,49 +15,237 @@ st.title("🚀 Productivity AI Toolkit")
 st.markdown("AI tools to identify automation opportunities, evaluate ideas, and reduce unnecessary meetings.")
 
 # ================= USER ROLE =================
-user_role = st.selectbox("Your Role", ["Operations", "Manager", "HR", "Finance", "IT"])
+ROLES = ["Operations", "Manager", "HR", "Finance", "IT"]
+user_role = st.selectbox("Your Role", ROLES)
 
 # ================= OPENROUTER CLIENT =================
 if "OPENROUTER_API_KEY" not in st.secrets:
     st.error("❌ OPENROUTER_API_KEY not found in Streamlit secrets.")
     st.stop()
 
-client = OpenAI(
-    api_key=st.secrets["OPENROUTER_API_KEY"],
-    base_url="https://openrouter.ai/api/v1"
-)
+# Cached so every rerun reuses one client and its HTTP connection pool
+@st.cache_resource
+def get_client():
+    return OpenAI(
+        api_key=st.secrets["OPENROUTER_API_KEY"],
+        base_url="https://openrouter.ai/api/v1"
+    )
+
+client = get_client()
 
 MODEL = "openai/gpt-4o-mini"
+EMBEDDING_MODEL = "openai/text-embedding-3-small"
+SIMILARITY_THRESHOLD = 0.93
+
+# ================= PROMPTS =================
+# Templates are filled in with .format(). Static instructions go first and user
+# inputs last, so repeat calls share an identical prefix that the provider's
+# automatic prompt caching can reuse
+SYSTEM_PROMPTS = {
+    role: f"You are a corporate productivity consultant helping a {role} improve efficiency."
+    for role in ROLES
+}
+
+AUTOMATION_PROMPT = """Assess each of the recurring tasks listed below for automation.
+
+Return only a JSON array, with no other text, where element i corresponds to task i and has the keys:
+- "automatable": true or false
+- "tool": tool suggested to automate it
+- "difficulty": "Low", "Medium" or "High"
+- "hours_saved": estimated hours saved per week
+
+---
+Recurring tasks (JSON array of objects with keys Task, Hours per Week, Tool Used):
+{tasks}"""
+
+IDEA_PROMPT = """Evaluate this internal idea.
+
+---
+Inputs:
+Idea: {idea_name}
+Problem: {problem}
+Users: {users}
+Benefits: {benefits}
+Effort: {effort}
+Risks: {dependencies}
+"""
+
+MEETING_PROMPT = """Should this meeting happen?
+
+---
+Inputs:
+Topic: {topic}
+Objective: {objective}
+Decisions Needed: {decisions}
+Attendees: {attendees}
+Urgency: {urgency}
+"""
+
+# ================= RESPONSE CACHE =================
+# Answers are stored on disk, so they are shared by all sessions and survive restarts
+@st.cache_resource
+def get_response_cache():
+    return Cache(os.path.join(tempfile.gettempdir(), "prodkit_cache"))
+
+responses = get_response_cache()
+RESPONSE_TTL = 7 * 24 * 3600
 
 # ================= SESSION STATE =================
 if "ai_calls" not in st.session_state:
     st.session_state.ai_calls = 0
 
+# Stored as one list per column so the history table is built without per-row inference
 if "history" not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = {"type": [], "name": [], "result": [], "time": [], "hours": [], "savings": []}
+
+# Running totals for the dashboard, updated in save_history
+if "counters" not in st.session_state:
+    st.session_state.counters = {"Automation": 0, "Idea": 0, "Meeting": 0, "auto_hours": 0.0, "auto_savings": 0.0}
+
+# Prompt embeddings (stacked into one array per role) and the answers they got
+if "sem_cache" not in st.session_state:
+    st.session_state.sem_cache = {}
 
 MAX_CALLS = 8
+MAX_HISTORY = 500
+MAX_SIMILAR_PROMPTS = 128
 
-def can_use_ai():
+def prompt_hash(prompt):
+    return hashlib.blake2b(f"{MODEL}|{user_role}|{prompt}".encode(), digest_size=16).hexdigest()
+
+def check_quota(prompt):
+    # Exact cached answers are always available; only new requests are limited.
+    # write_similar_ai calls this itself, after its near-match lookup misses.
+    if prompt_hash(prompt) in responses:
+        return True
     if st.session_state.ai_calls >= MAX_CALLS:
         st.warning("⚠️ AI usage limit reached for this session.")
         return False
-    st.session_state.ai_calls += 1
     return True
 
-def ask_ai(prompt):
-    response = client.chat.completions.create(
+def record_call():
+    # Called by ask_ai once a completion request has been accepted, so cache hits and
+    # failed requests are free. Embedding lookups in write_similar_ai aren't counted.
+    st.session_state.ai_calls += 1
+
+def ask_ai(prompt, max_tokens, outcome):
+    # outcome["finish_reason"] is set from the stream so callers can tell a complete answer
+    # from one cut off by max_tokens
+    stream = client.chat.completions.create(
         model=MODEL,
         messages=[
-            {"role": "system", "content": f"You are a corporate productivity consultant helping a {user_role} improve efficiency."},
+            {"role": "system", "content": SYSTEM_PROMPTS[user_role]},
             {"role": "user", "content": prompt}
         ],
+        max_tokens=max_tokens,
+        temperature=0.2,
+        stream=True,
         extra_headers={
             "HTTP-Referer": "https://your-app-name.streamlit.app",
             "X-Title": "Corporate Productivity Toolkit"
         }
     )
-    return response.choices[0].message.content
+    record_call()
+    # Close the HTTP response even if the page reruns before the stream is read to the end
+    try:
+        for chunk in stream:
+            if chunk.choices:
+                if chunk.choices[0].finish_reason:
+                    outcome["finish_reason"] = chunk.choices[0].finish_reason
+                yield chunk.choices[0].delta.content or ""
+    finally:
+        stream.close()
+
+def write_ai(prompt, max_tokens):
+    # Stream a fresh answer into the page, or replay the stored one for repeat inputs.
+    # Answers cut off by max_tokens aren't cached, so resubmitting asks again.
+    key = prompt_hash(prompt)
+    result = responses.get(key)
+    if result is None:
+        outcome = {}
+        result = st.write_stream(ask_ai(prompt, max_tokens, outcome))
+        if outcome.get("finish_reason") != "length":
+            responses.set(key, result, expire=RESPONSE_TTL)
+    else:
+        st.write(result)
+    return result
+
+def fetch_ai(prompt, max_tokens, parse):
+    # Same cache as write_ai, for answers that are parsed before being shown. Returns the
+    # raw text and parse(text), or None if it doesn't parse; only parsed answers are cached.
+    key = prompt_hash(prompt)
+    result = responses.get(key)
+    if result is not None:
+        # Entries cached before the parser was tightened may no longer parse; drop them and ask again
+        try:
+            return result, parse(result)
+        except ValueError:
+            responses.delete(key)
+
+    outcome = {}
+    result = "".join(ask_ai(prompt, max_tokens, outcome))
+    try:
+        parsed = parse(result)
+    except ValueError:
+        return result, None
+    if outcome.get("finish_reason") != "length":
+        responses.set(key, result, expire=RESPONSE_TTL)
+    return result, parsed
+
+def write_similar_ai(prompt, max_tokens, text, fields):
+    # Like write_ai, but reuses this session's answer to an earlier prompt whose free
+    # `text` is worded almost the same and whose other `fields` match exactly. Only the
+    # free text is embedded, so the template and short fields don't inflate the similarity.
+    # Checks the quota only when a new request is needed, returning None if it's used up.
+    if prompt_hash(prompt) in responses:
+        return write_ai(prompt, max_tokens)
+
+    # The embeddings request doesn't count towards MAX_CALLS. It costs a small fraction
+    # of a completion, and counting it would charge a cache hit like a real answer.
+    cache = st.session_state.sem_cache.setdefault(user_role, {"embeddings": None, "fields": [], "responses": []})
+    try:
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    except OpenAIError:
+        # The similarity lookup is only an optimization, so fall back to a normal request
+        return write_ai(prompt, max_tokens) if check_quota(prompt) else None
+    embedding = np.array(response.data[0].embedding)
+    candidates = [i for i, stored_fields in enumerate(cache["fields"]) if stored_fields == fields]
+    if candidates:
+        stored = cache["embeddings"][candidates]
+        similarity = stored @ embedding / (np.linalg.norm(stored, axis=1) * np.linalg.norm(embedding))
+        best = similarity.argmax()
+        if similarity[best] > SIMILARITY_THRESHOLD:
+            # Not copied into the shared disk cache, so a near match is only reused in this session
+            result = cache["responses"][candidates[best]]
+            st.write(result)
+            return result
+
+    if not check_quota(prompt):
+        return None
+    result = write_ai(prompt, max_tokens)
+    # Only complete answers (the ones write_ai cached) are offered for reuse
+    if prompt_hash(prompt) in responses:
+        cache["embeddings"] = embedding[np.newaxis] if cache["embeddings"] is None else np.vstack([cache["embeddings"], embedding])
+        cache["fields"].append(fields)
+        cache["responses"].append(result)
+        # Bounded like history, dropping the oldest entries
+        cache["embeddings"] = cache["embeddings"][-MAX_SIMILAR_PROMPTS:]
+        del cache["fields"][:-MAX_SIMILAR_PROMPTS]
+        del cache["responses"][:-MAX_SIMILAR_PROMPTS]
+    return result
+
+def parse_json(text):
+    # Models sometimes wrap JSON in a markdown code fence even when asked not to
+    text = text.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    return json.loads(text)
+
+def parse_plan(text, tasks):
+    # Needs exactly one JSON object per task. pandas would broadcast a single element or a
+    # bare object across every row, so anything else is rejected (and not cached).
+    data = parse_json(text)
+    if not (isinstance(data, list) and len(data) == len(tasks) and all(isinstance(e, dict) for e in data)):
+        raise ValueError("expected a JSON array with one object per task")
+    return pd.DataFrame(data, index=tasks)
 
 def save_history(entry):
     # Ensure all records have same keys to prevent dashboard errors
@@ -65,7 +258,25 @@ def save_history(entry):
         "savings": 0
     }
     default_entry.update(entry)
-    st.session_state.history.append(default_entry)
+    for column, values in st.session_state.history.items():
+        values.append(default_entry[column])
+        del values[:-MAX_HISTORY]
+
+    counters = st.session_state.counters
+    counters[default_entry["type"]] += 1
+    if default_entry["type"] == "Automation":
+        counters["auto_hours"] += default_entry["hours"]
+        counters["auto_savings"] += default_entry["savings"]
+
+@st.cache_resource
+def default_tasks_df():
+    # Seed rows for the task editor, built once and shared. st.data_editor copies its
+    # input before applying edits, so the shared frame is never mutated.
+    return pd.DataFrame({
+        "Task": ["Updating weekly Excel report", "Copying data from emails"],
+        "Hours per Week": [4, 3],
+        "Tool Used": ["Excel", "Outlook"]
+    })
 
 # ================= TABS =================
 tabs = st.tabs([
@@ -81,11 +292,7 @@ tabs = st.tabs([
 with tabs[0]:
     st.header("🔁 Repetitive Work & Automation ROI Calculator")
 
-    df = st.data_editor(pd.DataFrame({
-        "Task": ["Updating weekly Excel report", "Copying data from emails"],
-        "Hours per Week": [4, 3],
-        "Tool Used": ["Excel", "Outlook"]
-    }), num_rows="dynamic")
+    df = st.data_editor(default_tasks_df(), num_rows="dynamic")
 
     col1, col2 = st.columns(2)
     with col1:
@@ -94,8 +301,10 @@ with tabs[0]:
         automation_cost = st.number_input("Estimated Automation Build Cost ($)", 0, 50000, 2000)
 
     if st.button("Analyze Automation Potential"):
-        df["Monthly Hours"] = df["Hours per Week"] * 4
-        total_hours = df["Monthly Hours"].sum()
+        # Rows added in the editor can be left blank, so NaN is skipped like pandas' sum() did
+        monthly = df["Hours per Week"].to_numpy(dtype=float, na_value=np.nan) * 4
+        total_hours = np.nansum(monthly)
+        df["Monthly Hours"] = monthly
         annual_hours = total_hours * 12
 
         annual_savings = annual_hours * hourly_rate
@@ -112,20 +321,21 @@ with tabs[0]:
         if total_hours > 40:
             st.warning("⚠️ Significant automation opportunity detected!")
 
-        if can_use_ai():
-            result = ask_ai(f"""
-These recurring tasks were identified:
-
-{df.to_string()}
-
-Suggest:
-1. Tasks suitable for automation
-2. Tools to automate them
-3. Difficulty level
-4. Estimated % time reduction
-""")
+        # One request covers every row; the model answers with one JSON element per task
+        prompt = AUTOMATION_PROMPT.format(tasks=df[["Task", "Hours per Week", "Tool Used"]].to_json(orient="records", force_ascii=False))
+        if check_quota(prompt):
             st.subheader("🤖 AI Automation Plan")
-            st.write(result)
+            with st.spinner("Analyzing tasks..."):
+                # Each JSON element takes roughly 40 tokens, so the limit grows with the task list
+                result, plan = fetch_ai(
+                    prompt,
+                    max_tokens=max(600, 100 + 50 * len(df)),
+                    parse=lambda text: parse_plan(text, df["Task"])
+                )
+            if plan is None:
+                st.write(result)
+            else:
+                st.dataframe(plan)
 
             save_history({
                 "type": "Automation",
@@ -151,21 +361,24 @@ with tabs[1]:
         dependencies = st.text_area("Dependencies / Risks")
 
     if st.button("Evaluate Idea"):
-        if can_use_ai():
-            prompt = f"""
-Evaluate this internal idea.
-
-Idea: {idea_name}
-Problem: {problem}
-Users: {users}
-Benefits: {benefits}
-Effort: {effort}
-Risks: {dependencies}
-"""
-            result = ask_ai(prompt)
-            with col2:
-                st.write(result)
-
+        prompt = IDEA_PROMPT.format(
+            idea_name=idea_name,
+            problem=problem,
+            users=users,
+            benefits=benefits,
+            effort=effort,
+            dependencies=dependencies
+        )
+        # The quota is checked inside write_similar_ai, so near-match hits still work after the limit
+        with col2, st.spinner("Thinking..."):
+            result = write_similar_ai(
+                prompt,
+                max_tokens=400,
+                text="\n".join([idea_name, problem, benefits, dependencies]),
+                fields=(effort, users)
+            )
+
+        if result is not None:
             save_history({
                 "type": "Idea",
                 "name": idea_name,
@@ -185,18 +398,16 @@ with tabs[2]:
     urgency = st.selectbox("Urgency Level", ["Low", "Medium", "High"])
 
     if st.button("Evaluate Meeting"):
-        if can_use_ai():
-            prompt = f"""
-Should this meeting happen?
-
-Topic: {topic}
-Objective: {objective}
-Decisions Needed: {decisions}
-Attendees: {attendees}
-Urgency: {urgency}
-"""
-            result = ask_ai(prompt)
-            st.write(result)
+        prompt = MEETING_PROMPT.format(
+            topic=topic,
+            objective=objective,
+            decisions=decisions,
+            attendees=attendees,
+            urgency=urgency
+        )
+        if check_quota(prompt):
+            with st.spinner("Thinking..."):
+                result = write_ai(prompt, max_tokens=300)
 
             save_history({
                 "type": "Meeting",
@@ -210,24 +421,22 @@ Urgency: {urgency}
 with tabs[3]:
     st.header("📊 Productivity Impact Dashboard")
 
-    if st.session_state.history:
-        hist_df = pd.DataFrame(st.session_state.history)
+    if st.session_state.history["type"]:
+        counters = st.session_state.counters
+        counts = pd.Series({t: counters[t] for t in ["Automation", "Idea", "Meeting"] if counters[t]})
 
-        st.metric("Total Evaluations", len(hist_df))
-        st.metric("Ideas Reviewed", len(hist_df[hist_df["type"] == "Idea"]))
-        st.metric("Meetings Checked", len(hist_df[hist_df["type"] == "Meeting"]))
+        st.metric("Total Evaluations", int(counts.sum()))
+        st.metric("Ideas Reviewed", counters["Idea"])
+        st.metric("Meetings Checked", counters["Meeting"])
 
-        auto_hours = hist_df.loc[hist_df["type"] == "Automation", "hours"].sum()
-        auto_savings = hist_df.loc[hist_df["type"] == "Automation", "savings"].sum()
+        st.metric("Repetitive Hours Identified", f"{counters['auto_hours']:.1f} hrs/month")
+        st.metric("Total Annual Savings Identified", f"${counters['auto_savings']:,.0f}")
 
-        st.metric("Repetitive Hours Identified", f"{auto_hours:.1f} hrs/month")
-        st.metric("Total Annual Savings Identified", f"${auto_savings:,.0f}")
+        st.bar_chart(counts)
 
-        fig = go.Figure(go.Bar(
-            x=hist_df["type"].value_counts().index,
-            y=hist_df["type"].value_counts().values
-        ))
-        st.plotly_chart(fig, use_container_width=True)
+        # The full history table is only built when asked for
+        if st.checkbox("Show evaluation history"):
+            st.dataframe(pd.DataFrame(st.session_state.history))
 
     else:
         st.info("No activity yet. Run an analysis to see productivity insights!")